@@ -1,63 +1,165 @@
-import * as cheerio from 'cheerio';
-import type { AnyNode } from 'domhandler';
+import { Parser } from 'htmlparser2';
 
-const ALLOWED_ATTRS = new Set(['id', 'class', 'name', 'type', 'href', 'placeholder', 'role']);
+// Allowed attribute names, plus any attribute starting with 'data' or 'test'
+const ALLOWED_ATTR_RE = /^(?:(?:id|class|name|type|href|placeholder|role)$|data|test)/;
 const MAX_ATTR_LENGTH = 40;
 
+// Bounded LRU cache of simplified HTML, keyed by the raw input. Map preserves
+// insertion order, so the first key is always the least recently used.
+const CACHE_MAX_SIZE = 4096;
+const simplifyCache = new Map<string, string>();
+let cacheHits = 0;
+let cacheMisses = 0;
+
 /**
- * Filter and format allowed attributes for an HTML tag.
- * Includes attributes in ALLOWED_ATTRS and any attribute starting with 'data' or 'test'.
+ * A top-level node of a parsed snippet. Tags carry the text of all their
+ * descendants; 'other' marks comments and directives, which only separate text.
  */
-function filterAttributes(attrs: Record<string, string | undefined>): string {
-  const filtered: string[] = [];
-  
-  for (const [attr, value] of Object.entries(attrs)) {
-    if (value === undefined) continue;
-    
-    const shouldInclude = (
-      ALLOWED_ATTRS.has(attr) ||
-      attr.startsWith('data') ||
-      attr.startsWith('test')
-    ) && value.length <= MAX_ATTR_LENGTH;
+interface TopLevelNode {
+  type: 'tag' | 'text' | 'other';
+  name: string;
+  attribs: Record<string, string>;
+  text: string;
+}
+
+/**
+ * Append the allowed attributes of an HTML tag to the output parts.
+ * Includes attributes matched by ALLOWED_ATTR_RE within MAX_ATTR_LENGTH.
+ */
+function appendAttributes(parts: string[], attrs: Record<string, string>): void {
+  for (const attr in attrs) {
+    const value = attrs[attr];
     
-    if (shouldInclude) {
-      filtered.push(`${attr}="${value}"`);
+    if (ALLOWED_ATTR_RE.test(attr) && value.length <= MAX_ATTR_LENGTH) {
+      parts.push(' ', attr, '="', value, '"');
     }
   }
-  
-  return filtered.length > 0 ? ' ' + filtered.join(' ') : '';
 }
 
 /**
- * Simplify a cheerio element: keep allowed attributes and inner text.
+ * Simplify a parsed element: keep allowed attributes and inner text.
+ * The output is assembled with a single join to avoid intermediate strings.
  */
-function simplifyTag($: cheerio.CheerioAPI, element: AnyNode): string {
-  const $elem = $(element);
-  const attrs = $elem.attr() || {};
-  const attrStr = filterAttributes(attrs);
-  const innerText = $elem.text().trim();
-  const tagName = (element as any).name || (element as any).tagName;
+function simplifyTag(node: TopLevelNode): string {
+  const parts = ['<', node.name];
+  appendAttributes(parts, node.attribs);
+  parts.push('>', node.text.trim(), '</', node.name, '>');
   
-  return `<${tagName}${attrStr}>${innerText}</${tagName}>`;
+  return parts.join('');
 }
 
 /**
  * Simplify HTML by keeping only allowed attributes and always preserving inner text.
- * Handles single tags, fragments, and plain text.
+ * Handles single tags, fragments, and plain text. Results are memoized.
  */
 export function simplifyHtml(html: string): string {
-  const $ = cheerio.load(html, null, false);
-  const root = $.root();
-  const contents = root.contents().toArray();
+  const cached = simplifyCache.get(html);
+  if (cached !== undefined) {
+    cacheHits++;
+    // Move to the most recently used position
+    simplifyCache.delete(html);
+    simplifyCache.set(html, cached);
+    return cached;
+  }
+
+  cacheMisses++;
+  const simplified = parseAndSimplify(html);
+  simplifyCache.set(html, simplified);
+  if (simplifyCache.size > CACHE_MAX_SIZE) {
+    simplifyCache.delete(simplifyCache.keys().next().value as string);
+  }
+  return simplified;
+}
+
+/**
+ * Report simplifyHtml cache statistics, useful for tuning CACHE_MAX_SIZE.
+ */
+export function simplifyHtmlCacheInfo(): {
+  hits: number;
+  misses: number;
+  maxSize: number;
+  currentSize: number;
+} {
+  return {
+    hits: cacheHits,
+    misses: cacheMisses,
+    maxSize: CACHE_MAX_SIZE,
+    currentSize: simplifyCache.size,
+  };
+}
+
+// State filled in by the shared parser's callbacks, reset before every parse
+let parsedNodes: TopLevelNode[] = [];
+let parseDepth = 0;
+// Node receiving text: the open top-level tag or the current text run
+let currentNode: TopLevelNode | null = null;
+
+/**
+ * Close the current top-level text run at a comment or directive.
+ */
+function endTextRun(): void {
+  if (parseDepth === 0) {
+    parsedNodes.push({ type: 'other', name: '', attribs: {}, text: '' });
+    currentNode = null;
+  }
+}
+
+// A single parser is reused for every snippet instead of constructing one per call
+const parser = new Parser({
+  onreset() {
+    parsedNodes = [];
+    parseDepth = 0;
+    currentNode = null;
+  },
+  onopentag(name, attribs) {
+    if (parseDepth === 0) {
+      currentNode = { type: 'tag', name, attribs, text: '' };
+      parsedNodes.push(currentNode);
+    }
+    parseDepth++;
+  },
+  onclosetag() {
+    parseDepth--;
+    if (parseDepth === 0) {
+      currentNode = null;
+    }
+  },
+  ontext(data) {
+    if (currentNode === null) {
+      currentNode = { type: 'text', name: '', attribs: {}, text: '' };
+      parsedNodes.push(currentNode);
+    }
+    currentNode.text += data;
+  },
+  oncommentend: endTextRun,
+  onprocessinginstruction: endTextRun,
+});
+
+/**
+ * Parse HTML into its top-level nodes.
+ *
+ * Only tag names, attributes and text are needed, so they are collected from
+ * the streaming parser callbacks instead of building a DOM for the snippet.
+ */
+function parseTopLevel(html: string): TopLevelNode[] {
+  parser.parseComplete(html);
+  return parsedNodes;
+}
+
+/**
+ * Parse HTML and build its simplified form.
+ */
+function parseAndSimplify(html: string): string {
+  const contents = parseTopLevel(html);
   
   // If the input is just text, return as is
   if (contents.length === 0 || (contents.length === 1 && contents[0].type === 'text')) {
-    return root.text().trim();
+    return contents.length === 0 ? '' : contents[0].text.trim();
   }
   
   // If the input is a single tag
   if (contents.length === 1 && contents[0].type === 'tag') {
-    return simplifyTag($, contents[0]);
+    return simplifyTag(contents[0]);
   }
   
   // If the input is a fragment, process each node at the top level
@@ -65,9 +167,9 @@ export function simplifyHtml(html: string): string {
   
   for (const node of contents) {
     if (node.type === 'tag') {
-      simplified.push(simplifyTag($, node));
+      simplified.push(simplifyTag(node));
     } else if (node.type === 'text') {
-      const text = $(node).text().trim();
+      const text = node.text.trim();
       if (text) {
         simplified.push(text);
       }
@@ -1,34 +1,146 @@
-import { Builder, WebDriver, By, until } from "selenium-webdriver";
+import { Builder, By, until } from "selenium-webdriver";
 import * as chrome from "selenium-webdriver/chrome";
 import * as fs from "fs";
 import * as path from "path";
 import * as readline from "readline";
 import { simplifyHtml } from "./element-simplifier";
 import type {
+  BoundEvent,
+  CdpCompileScriptResult,
+  CdpConnection,
+  CdpRunScriptResult,
   Config,
   ClickedElement,
   InputEvent,
-  RecordedEvent,
-  PageMap,
+  InteractionBatch,
+  EventColumns,
+  PageEvents,
+  PageSet,
   RecordingStage,
   StageEvents,
 } from "./types";
 
+/**
+ * Name of the CDP binding the injected script uses to push events to Node
+ */
+const EVENT_BINDING_NAME = "__testRecorderSink";
+
+/**
+ * Polling interval bounds: poll quickly while the user is active and back off
+ * exponentially (50ms, 100ms, ... capped at 2s) after consecutive idle polls
+ */
+const MIN_POLL_INTERVAL_MS = 50;
+const MAX_POLL_INTERVAL_MS = 2000;
+const MAX_IDLE_STEPS = 6;
+
+/**
+ * How often to check for <body> while waiting to inject listeners after a
+ * navigation (selenium's default is 200ms)
+ */
+const BODY_WAIT_POLL_MS = 50;
+
+/**
+ * Cap on unique clicks/inputs remembered per page for dedup; the oldest entry
+ * is evicted first so long sessions keep bounded memory
+ */
+const MAX_UNIQUE_PER_PAGE = 10000;
+
+/**
+ * File in the working directory that every recorded event is appended to as
+ * one JSON line, so a session survives a crash before the final report
+ */
+const EVENT_LOG_FILE = "events.jsonl";
+
+/**
+ * The previous session's event log is kept under this name, so restarting
+ * after a crash does not wipe the log that survived it
+ */
+const PREVIOUS_EVENT_LOG_FILE = "events.prev.jsonl";
+
+/**
+ * Reads and clears all pending interactions in one WebDriver round-trip.
+ * Events queued by a previous document were persisted to localStorage on
+ * unload and come before the ones queued in the current page. Written as an
+ * expression so it can be compiled once with CDP Runtime.compileScript.
+ * The batch is returned as one JSON string and parsed once in Node, rather
+ * than deep-converted value by value by the driver.
+ */
+const POLL_INTERACTIONS_SCRIPT = `(function() {
+  var queue = window.__testRecorderQueue || { clicks: [], inputs: [] };
+  var clicks = queue.clicks;
+  var inputs = queue.inputs;
+  var stageChange = localStorage.stageChange || null;
+  // Only touch localStorage when an unloaded document left events behind.
+  // Everything is read before anything is cleared, so if a read throws the
+  // queue and the persisted events are all still there for the next poll.
+  var persistedClicks = localStorage.clickedElements;
+  var persistedInputs = localStorage.inputEvents;
+  if (persistedClicks) {
+    clicks = JSON.parse(persistedClicks).concat(clicks);
+  }
+  if (persistedInputs) {
+    inputs = JSON.parse(persistedInputs).concat(inputs);
+  }
+  if (persistedClicks) {
+    localStorage.removeItem('clickedElements');
+  }
+  if (persistedInputs) {
+    localStorage.removeItem('inputEvents');
+  }
+  if (stageChange) {
+    localStorage.removeItem('stageChange');
+  }
+  window.__testRecorderQueue = { clicks: [], inputs: [] };
+  return JSON.stringify({
+    clicks: clicks,
+    inputs: inputs,
+    stageChange: stageChange,
+    url: window.location.href
+  });
+})()`;
+
+/**
+ * Marks the given stage (arguments[0]) as current in the popup. The source
+ * is constant so the browser can reuse its compiled form on every switch.
+ */
+const UPDATE_POPUP_SCRIPT = `
+  var stage = arguments[0];
+  if (typeof localStorage !== 'undefined') {
+    localStorage.currentStage = stage;
+    var currentStageEl = document.getElementById('current-stage');
+    if (currentStageEl) {
+      currentStageEl.textContent = stage;
+    }
+    var buttons = document.querySelectorAll('.stage-btn');
+    buttons.forEach(function(btn) {
+      btn.classList.remove('active');
+      if (btn.dataset.stage === stage) {
+        btn.classList.add('active');
+      }
+    });
+  }
+`;
+
 export class TestRecorder {
-  private driver!: WebDriver;
-  private pageClicksMap: PageMap<string> = {};
-  private pageInputsMap: PageMap<InputEvent> = {};
-  private pageEventsMap: PageMap<RecordedEvent> = {};
+  private driver!: chrome.Driver;
+  private pageClicksMap: PageSet = {};
+  private pageInputsMap: PageSet = {};
+  private pageEventsMap: PageEvents = {};
   private currentUrl: string = "";
-  private monitoringInterval?: NodeJS.Timeout;
+  private monitoringTimeout?: NodeJS.Timeout;
   private isRunning: boolean = false;
+  private recordedEventCount: number = 0;
   private currentStage: RecordingStage = "GIVEN";
   private stageEvents: StageEvents[] = [];
+  private listenersInstalledOnNewDocument: boolean = false;
+  private pollScriptId?: string;
+  private compiledPollUnavailable: boolean = false;
+  private eventLogFd?: number;
 
   /**
    * Initialize the Chrome WebDriver with maximized window
    */
-  private async initDriver(): Promise<WebDriver> {
+  private async initDriver(): Promise<chrome.Driver> {
     const options = new chrome.Options();
     options.addArguments("--start-maximized");
 
@@ -37,7 +149,60 @@ export class TestRecorder {
       .setChromeOptions(options)
       .build();
 
-    return driver;
+    return driver as chrome.Driver;
+  }
+
+  /**
+   * Subscribe to events pushed by the page through a CDP runtime binding.
+   * Falls back to localStorage polling when no CDP connection is available.
+   */
+  private async enableEventBinding(): Promise<void> {
+    try {
+      const connection: CdpConnection =
+        await this.driver.createCDPConnection("page");
+      connection._wsConnection.on("message", (data) =>
+        this.handleCdpMessage(data.toString())
+      );
+      connection.execute("Runtime.enable", {}, null);
+      connection.execute(
+        "Runtime.addBinding",
+        { name: EVENT_BINDING_NAME },
+        null
+      );
+    } catch (error) {
+      console.warn("CDP binding unavailable, polling the page queue instead");
+    }
+  }
+
+  /**
+   * Dispatch a click, input or stage change delivered through the CDP binding
+   */
+  private handleCdpMessage(message: string): void {
+    const data = JSON.parse(message);
+    if (
+      data.method !== "Runtime.bindingCalled" ||
+      data.params?.name !== EVENT_BINDING_NAME
+    ) {
+      return;
+    }
+
+    try {
+      const bound: BoundEvent = JSON.parse(data.params.payload);
+      if (bound.type === "click") {
+        this.recordClickEvents([bound.event]);
+      } else if (bound.type === "input") {
+        this.recordInputEvents([bound.event]);
+      } else if (
+        bound.type === "stage" &&
+        this.isRecordingStage(bound.event)
+      ) {
+        this.checkStageChange(bound.event).catch((error) =>
+          console.error("Error switching stage:", error)
+        );
+      }
+    } catch (error) {
+      // Ignore malformed payloads (the binding is callable by page scripts)
+    }
   }
 
   /**
@@ -47,7 +212,10 @@ export class TestRecorder {
     try {
       this.registerShutdownHooks();
       this.setupStageInput();
+      this.openEventLog();
       this.driver = await this.initDriver();
+      await this.enableEventBinding();
+      await this.installEventListenersOnNewDocument();
       const baseUrl = this.getBaseUrlFromConfig();
       await this.openInitialPage(baseUrl);
 
@@ -104,17 +272,17 @@ export class TestRecorder {
     const newStage = stageMap[key];
     if (newStage !== this.currentStage) {
       // Save all events from all pages for current stage before switching
-      const allEvents: RecordedEvent[] = [];
+      const pages: PageEvents = {};
       for (const url in this.pageEventsMap) {
-        if (this.pageEventsMap[url]?.length > 0) {
-          allEvents.push(...this.pageEventsMap[url]);
+        if (this.pageEventsMap[url]?.types.length > 0) {
+          pages[url] = this.pageEventsMap[url];
         }
       }
 
-      if (allEvents.length > 0) {
+      if (Object.keys(pages).length > 0) {
         this.stageEvents.push({
           stage: this.currentStage,
-          events: allEvents,
+          pages,
         });
       }
 
@@ -133,19 +301,12 @@ export class TestRecorder {
   /**
    * Check if stage was changed from UI popup
    */
-  private async checkStageChange(): Promise<void> {
-    try {
-      const stageChange = await this.driver.executeScript<string>(
-        `return localStorage.stageChange || null`
-      );
-
-      if (stageChange && stageChange !== this.currentStage) {
-        const key = this.getStageKey(stageChange as RecordingStage);
-        await this.switchStage(key);
-        await this.driver.executeScript(`delete localStorage.stageChange`);
-      }
-    } catch (error) {
-      // Silently ignore errors (e.g., if page hasn't loaded yet)
+  private async checkStageChange(
+    stageChange: RecordingStage | null
+  ): Promise<void> {
+    if (stageChange && stageChange !== this.currentStage) {
+      const key = this.getStageKey(stageChange);
+      await this.switchStage(key);
     }
   }
 
@@ -154,27 +315,20 @@ export class TestRecorder {
    */
   private async updatePopupUI(stage: RecordingStage): Promise<void> {
     try {
-      await this.driver.executeScript(`
-        if (typeof localStorage !== 'undefined') {
-          localStorage.currentStage = '${stage}';
-          var currentStageEl = document.getElementById('current-stage');
-          if (currentStageEl) {
-            currentStageEl.textContent = '${stage}';
-          }
-          var buttons = document.querySelectorAll('.stage-btn');
-          buttons.forEach(function(btn) {
-            btn.classList.remove('active');
-            if (btn.dataset.stage === '${stage}') {
-              btn.classList.add('active');
-            }
-          });
-        }
-      `);
+      await this.driver.executeScript(UPDATE_POPUP_SCRIPT, stage);
     } catch (error) {
       // Silently ignore errors (e.g., if popup isn't rendered yet)
     }
   }
 
+  /**
+   * Check that a stage requested by the page is a known one, since page
+   * scripts can call the binding and write localStorage too
+   */
+  private isRecordingStage(stage: unknown): stage is RecordingStage {
+    return stage === "GIVEN" || stage === "WHEN" || stage === "THEN";
+  }
+
   /**
    * Convert stage name to keyboard key
    */
@@ -187,6 +341,77 @@ export class TestRecorder {
     return stageKeyMap[stage];
   }
 
+  /**
+   * Open the event log, keeping a non-empty log left by the previous session
+   * as PREVIOUS_EVENT_LOG_FILE
+   */
+  private openEventLog(): void {
+    const logPath = path.join(process.cwd(), EVENT_LOG_FILE);
+    try {
+      if (fs.existsSync(logPath) && fs.statSync(logPath).size > 0) {
+        fs.renameSync(
+          logPath,
+          path.join(process.cwd(), PREVIOUS_EVENT_LOG_FILE)
+        );
+      }
+      this.eventLogFd = fs.openSync(logPath, "w");
+    } catch (error) {
+      // Recording still works without the log; only crash safety is lost
+      console.warn(
+        `Could not open ${logPath}, events will not be logged:`,
+        (error as Error).message
+      );
+      this.eventLogFd = undefined;
+    }
+  }
+
+  /**
+   * Append one event to the event log. Written synchronously so each line is
+   * on disk even if the process is killed right after. If a write fails, the
+   * log is closed and recording continues without it.
+   */
+  private logEvent(
+    url: string,
+    eventType: "click" | "input",
+    html: string,
+    simplified: string,
+    value?: string
+  ): void {
+    if (this.eventLogFd === undefined) return;
+
+    const line = JSON.stringify({
+      stage: this.currentStage,
+      type: eventType,
+      url,
+      html,
+      simplified,
+      value,
+    });
+    try {
+      fs.writeSync(this.eventLogFd, line + "\n");
+    } catch (error) {
+      console.warn(
+        `Could not write to ${EVENT_LOG_FILE}, events will no longer be logged:`,
+        (error as Error).message
+      );
+      this.closeEventLog();
+    }
+  }
+
+  /**
+   * Close the event log if it is open
+   */
+  private closeEventLog(): void {
+    if (this.eventLogFd === undefined) return;
+
+    try {
+      fs.closeSync(this.eventLogFd);
+    } catch (error) {
+      // The log is being abandoned anyway
+    }
+    this.eventLogFd = undefined;
+  }
+
   /**
    * Read and validate the base URL from config.json
    */
@@ -221,7 +446,9 @@ export class TestRecorder {
     await this.driver.get(url);
     this.currentUrl = await this.driver.getCurrentUrl();
     this.initializePageMaps(this.currentUrl);
-    await this.injectEventListeners();
+    if (!this.listenersInstalledOnNewDocument) {
+      await this.injectEventListeners();
+    }
   }
 
   /**
@@ -229,10 +456,12 @@ export class TestRecorder {
    */
   private async monitorUserInteractions(): Promise<void> {
     this.isRunning = true;
+    let idleCount = 0;
+    let lastEventCount = this.recordedEventCount;
 
-    this.monitoringInterval = setInterval(async () => {
+    const poll = async () => {
+      const startedAt = Date.now();
       try {
-        await this.handleUrlChange();
         await this.recordAllInteractions();
       } catch (error) {
         // If there's a WebDriver error (browser closed), stop monitoring and print report
@@ -249,7 +478,28 @@ export class TestRecorder {
         await this.printRecordedElements();
         process.exit(0);
       }
-    }, 1000); // Poll every 1 second
+
+      // Events pushed through the CDP binding between polls count as activity
+      const hadEvents = this.recordedEventCount !== lastEventCount;
+      lastEventCount = this.recordedEventCount;
+      idleCount = hadEvents ? 0 : Math.min(idleCount + 1, MAX_IDLE_STEPS);
+      const pollInterval = Math.min(
+        MAX_POLL_INTERVAL_MS,
+        MIN_POLL_INTERVAL_MS * 2 ** idleCount
+      );
+
+      // Count the interval from the start of this poll, so the round-trip
+      // overlaps the wait instead of being added on top of it
+      const elapsed = Date.now() - startedAt;
+      if (this.isRunning) {
+        this.monitoringTimeout = setTimeout(
+          poll,
+          Math.max(0, pollInterval - elapsed)
+        );
+      }
+    };
+
+    this.monitoringTimeout = setTimeout(poll, MIN_POLL_INTERVAL_MS);
 
     // Keep the process running
     return new Promise<void>((resolve) => {
@@ -267,151 +517,295 @@ export class TestRecorder {
    */
   private stopMonitoring(): void {
     this.isRunning = false;
-    if (this.monitoringInterval) {
-      clearInterval(this.monitoringInterval);
+    if (this.monitoringTimeout) {
+      clearTimeout(this.monitoringTimeout);
     }
   }
 
   /**
    * Handle URL changes and reinject event listeners
    */
-  private async handleUrlChange(): Promise<void> {
-    const newUrl = await this.driver.getCurrentUrl();
-
+  private async handleUrlChange(newUrl: string): Promise<void> {
     if (this.currentUrl !== newUrl) {
       this.currentUrl = newUrl;
-      await this.driver.wait(until.elementLocated(By.tagName("body")), 10000);
-      await this.injectEventListeners();
+      // Listeners installed on new documents need no body to attach to
+      if (!this.listenersInstalledOnNewDocument) {
+        await this.driver.wait(
+          until.elementLocated(By.tagName("body")),
+          10000,
+          undefined,
+          BODY_WAIT_POLL_MS
+        );
+        // Same-document navigations (hash/history changes) keep the
+        // listeners, so only send the full script when a new document loaded
+        if (!(await this.areEventListenersInjected())) {
+          await this.injectEventListeners();
+        }
+      }
       this.initializePageMaps(this.currentUrl);
     }
   }
 
+  /**
+   * Check whether the current document already has the event listeners
+   */
+  private async areEventListenersInjected(): Promise<boolean> {
+    const injected = await this.driver.executeScript<boolean>(
+      `return !!window.__testRecorderInjected`
+    );
+    return injected === true;
+  }
+
   /**
    * Initialize page maps for a given URL
    */
   private initializePageMaps(url: string): void {
-    if (!this.pageClicksMap[url]) this.pageClicksMap[url] = [];
-    if (!this.pageInputsMap[url]) this.pageInputsMap[url] = [];
-    if (!this.pageEventsMap[url]) this.pageEventsMap[url] = [];
+    if (!this.pageClicksMap[url]) this.pageClicksMap[url] = new Set();
+    if (!this.pageInputsMap[url]) this.pageInputsMap[url] = new Set();
+    if (!this.pageEventsMap[url]) {
+      this.pageEventsMap[url] = this.createEventColumns();
+    }
+  }
+
+  /**
+   * Create empty event columns for a page
+   */
+  private createEventColumns(): EventColumns {
+    return { types: [], htmls: [], simplified: [], values: [] };
   }
 
   /**
    * Record all types of interactions
    */
   private async recordAllInteractions(): Promise<void> {
-    await this.checkStageChange();
-    await this.recordClickEvents();
-    await this.recordInputEvents();
+    const batch = await this.pollInteractions();
+    await this.handleUrlChange(batch.url);
+    await this.checkStageChange(batch.stageChange);
+    this.recordClickEvents(batch.clicks);
+    this.recordInputEvents(batch.inputs);
   }
 
   /**
-   * Record click events from localStorage
+   * Read and clear pending clicks, inputs and stage changes from the page,
+   * along with its current URL
    */
-  private async recordClickEvents(): Promise<void> {
-    const clickedElements = await this.getJsArray<ClickedElement>(
-      "localStorage.clickedElements"
-    );
-
-    for (const clicked of clickedElements) {
-      const pageUrl = clicked.url || this.currentUrl;
-      const html = clicked.html || "";
-      this.appendUnique(this.pageClicksMap, pageUrl, html);
-      this.appendEvent(pageUrl, "click", html);
+  private async pollInteractions(): Promise<InteractionBatch> {
+    let payload = await this.runCompiledPollScript();
+    if (payload === undefined) {
+      payload = await this.driver.executeScript<string | null>(
+        `return ${POLL_INTERACTIONS_SCRIPT}`
+      );
     }
-
-    await this.clearJsArray("localStorage.clickedElements");
+    const batch: InteractionBatch | null = payload ? JSON.parse(payload) : null;
+    const stageChange = batch?.stageChange;
+    return {
+      clicks: batch?.clicks || [],
+      inputs: batch?.inputs || [],
+      stageChange: this.isRecordingStage(stageChange) ? stageChange : null,
+      url: batch?.url || this.currentUrl,
+    };
   }
 
   /**
-   * Record input events from localStorage
+   * Run the poll script through CDP so it is parsed and compiled once per
+   * document instead of on every tick. Returns undefined when the compiled
+   * script cannot be used, so the caller falls back to executeScript, and
+   * null when this tick should be skipped.
    */
-  private async recordInputEvents(): Promise<void> {
-    const inputEvents = await this.getJsArray<InputEvent>(
-      "localStorage.inputEvents"
-    );
+  private async runCompiledPollScript(): Promise<string | null | undefined> {
+    if (this.compiledPollUnavailable) {
+      return undefined;
+    }
 
-    for (const event of inputEvents) {
-      const value = event.value || "";
-      const html = event.html || "";
+    if (!this.pollScriptId) {
+      try {
+        const compiled = await this.sendCdpCommand<CdpCompileScriptResult>(
+          "Runtime.compileScript",
+          {
+            expression: POLL_INTERACTIONS_SCRIPT,
+            sourceURL: "test-recorder-poll.js",
+            persistScript: true,
+          }
+        );
+        this.pollScriptId = compiled.scriptId;
+      } catch (error) {
+        // Compiling fails transiently mid-navigation, when there is no
+        // default context yet; only give up for good if CDP lacks the command
+        if (this.isUnsupportedCdpError(error)) {
+          this.compiledPollUnavailable = true;
+        }
+        return undefined;
+      }
 
-      if (!this.isInputAlreadyRecorded(this.currentUrl, value, html)) {
-        this.pageInputsMap[this.currentUrl].push(event);
-        console.log(`Input Event: keys sent: ${value}; html element:${html}`);
+      if (!this.pollScriptId) {
+        // CDP rejected the script; always use executeScript
+        this.compiledPollUnavailable = true;
+        return undefined;
       }
+    }
 
-      this.appendEvent(this.currentUrl, "input", html, value);
+    try {
+      const response = await this.sendCdpCommand<
+        CdpRunScriptResult<string | null>
+      >("Runtime.runScript", {
+        scriptId: this.pollScriptId,
+        returnByValue: true,
+      });
+      if (response.exceptionDetails) {
+        // Running the same script through executeScript would hit the same
+        // error, so skip this tick and leave the queue for the next one
+        return null;
+      }
+      return response.result.value ?? null;
+    } catch {
+      // Compiled scripts belong to a document; recompile on the next tick.
+      // The script may have drained the queue before the response was lost,
+      // so do not run it again in this tick.
+      this.pollScriptId = undefined;
+      return null;
     }
+  }
 
-    await this.clearJsArray("localStorage.inputEvents");
+  /**
+   * Whether a CDP command failed because the browser or driver does not
+   * support it, rather than because of the current page state
+   */
+  private isUnsupportedCdpError(error: unknown): boolean {
+    if (error instanceof TypeError) return true;
+    const message = (error as Error)?.message || "";
+    return /wasn't found|unknown command|not supported/i.test(message);
   }
 
   /**
-   * Get a JSON array from JavaScript storage
+   * Send a CDP command through the driver and return its result
    */
-  private async getJsArray<T>(storageKey: string): Promise<T[]> {
-    try {
-      const result = await this.driver.executeScript<T[]>(
-        `return JSON.parse(${storageKey} || '[]')`
-      );
-      return result || [];
-    } catch {
-      return [];
+  private async sendCdpCommand<T>(cmd: string, params: object): Promise<T> {
+    const result = await this.driver.sendAndGetDevToolsCommand(cmd, params);
+    return result as unknown as T;
+  }
+
+  /**
+   * Record click events, simplifying each element once as it arrives
+   */
+  private recordClickEvents(clickedElements: ClickedElement[]): void {
+    for (const clicked of clickedElements) {
+      const pageUrl = clicked.url || this.currentUrl;
+      const html = clicked.html || "";
+      const simplified = simplifyHtml(html);
+      this.appendUnique(this.pageClicksMap, pageUrl, simplified);
+      this.appendEvent(pageUrl, "click", html, simplified);
     }
   }
 
   /**
-   * Clear a JSON array in JavaScript storage
+   * Record input events, simplifying each element once as it arrives
    */
-  private async clearJsArray(storageKey: string): Promise<void> {
-    await this.driver.executeScript(`${storageKey} = JSON.stringify([])`);
+  private recordInputEvents(inputEvents: InputEvent[]): void {
+    for (const event of inputEvents) {
+      const pageUrl = event.url || this.currentUrl;
+      const value = event.value || "";
+      const html = event.html || "";
+      const simplified = simplifyHtml(html);
+
+      const key = this.inputKey(value, simplified);
+      if (!this.pageInputsMap[pageUrl]) {
+        this.pageInputsMap[pageUrl] = new Set();
+      }
+      const recordedInputs = this.pageInputsMap[pageUrl];
+
+      if (!recordedInputs.has(key)) {
+        recordedInputs.add(key);
+        if (recordedInputs.size > MAX_UNIQUE_PER_PAGE) {
+          recordedInputs.delete(recordedInputs.values().next().value as string);
+        }
+        console.log(
+          `Input Event: keys sent: ${value}; html element:${simplified}`
+        );
+      }
+
+      this.appendEvent(pageUrl, "input", html, simplified, value);
+    }
   }
 
   /**
    * Append a unique value to a page map
    */
   private appendUnique(
-    mapping: PageMap<string>,
+    mapping: PageSet,
     key: string,
     value: string
   ): void {
     if (!mapping[key]) {
-      mapping[key] = [];
+      mapping[key] = new Set();
     }
 
-    if (!mapping[key].includes(value)) {
-      mapping[key].push(value);
+    if (!mapping[key].has(value)) {
+      mapping[key].add(value);
+      if (mapping[key].size > MAX_UNIQUE_PER_PAGE) {
+        mapping[key].delete(mapping[key].values().next().value as string);
+      }
       console.log(`Clicked Element: ${value} (URL: ${key})`);
     }
   }
 
   /**
-   * Check if an input event is already recorded
+   * Build the dedup key for an input event
    */
-  private isInputAlreadyRecorded(
-    url: string,
-    value: string,
-    html: string
-  ): boolean {
-    return this.pageInputsMap[url].some(
-      (e) => e.value === value && e.html === html
-    );
+  private inputKey(value: string, html: string): string {
+    return `${value}\u0000${html}`;
   }
 
   /**
-   * Append an event to the events map
+   * Append an event to the events map. Consecutive events of the same type on
+   * the same element are collapsed into one, keeping the latest input value,
+   * since the report only prints the last event per element anyway.
    */
   private appendEvent(
     url: string,
     eventType: "click" | "input",
     html: string,
+    simplified: string,
     value?: string
   ): void {
     if (!this.pageEventsMap[url]) {
-      this.pageEventsMap[url] = [];
+      this.pageEventsMap[url] = this.createEventColumns();
     }
 
-    const event: RecordedEvent = { type: eventType, html, value, url };
-    this.pageEventsMap[url].push(event);
+    this.recordedEventCount++;
+    const events = this.pageEventsMap[url];
+    const last = events.types.length - 1;
+    if (
+      last >= 0 &&
+      events.types[last] === eventType &&
+      events.htmls[last] === html
+    ) {
+      events.values[last] = value;
+    } else {
+      events.types.push(eventType);
+      events.htmls.push(html);
+      events.simplified.push(simplified);
+      events.values.push(value);
+    }
+
+    // Log only once the event is stored, so a failed write cannot lose it
+    this.logEvent(url, eventType, html, simplified, value);
+  }
+
+  /**
+   * Register the listener script to run on every new document via CDP, so
+   * listeners are attached before page scripts run and no injection round-trip
+   * is needed per navigation. Falls back to injecting after each navigation.
+   */
+  private async installEventListenersOnNewDocument(): Promise<void> {
+    try {
+      await this.driver.sendDevToolsCommand(
+        "Page.addScriptToEvaluateOnNewDocument",
+        { source: this.getEventListenerScript() }
+      );
+      this.listenersInstalledOnNewDocument = true;
+    } catch (error) {
+      // CDP is unavailable; inject after each navigation instead
+    }
   }
 
   /**
@@ -426,191 +820,241 @@ export class TestRecorder {
    */
   private getEventListenerScript(): string {
     return `
-      if (!window.__testRecorderInjected) {
+      if (!window.__testRecorderInjected && window === window.top) {
         window.__testRecorderInjected = true;
-        if (!localStorage.clickedElements) localStorage.clickedElements = JSON.stringify([]);
-        if (!localStorage.inputEvents) localStorage.inputEvents = JSON.stringify([]);
         if (!localStorage.currentStage) localStorage.currentStage = 'GIVEN';
         
+        // Push events through the CDP binding, or queue them in page scope
+        // for polling (no JSON round-trip through localStorage per event)
+        window.__testRecorderQueue = window.__testRecorderQueue || { clicks: [], inputs: [] };
+        function recordEvent(type, queueKey, event) {
+          if (typeof window.${EVENT_BINDING_NAME} === 'function') {
+            window.${EVENT_BINDING_NAME}(JSON.stringify({ type: type, event: event }));
+            return;
+          }
+          window.__testRecorderQueue[queueKey].push(event);
+        }
+        
+        // Persist events not yet polled before the document goes away
+        window.addEventListener('beforeunload', function() {
+          var queue = window.__testRecorderQueue;
+          if (queue.clicks.length > 0) {
+            localStorage.clickedElements = JSON.stringify(
+              JSON.parse(localStorage.clickedElements || '[]').concat(queue.clicks));
+          }
+          if (queue.inputs.length > 0) {
+            localStorage.inputEvents = JSON.stringify(
+              JSON.parse(localStorage.inputEvents || '[]').concat(queue.inputs));
+          }
+          window.__testRecorderQueue = { clicks: [], inputs: [] };
+        });
+        
+        // Serialize only what simplifyHtml keeps: the element's own tag and
+        // attributes plus its text, instead of the whole outerHTML subtree
+        function escapeHtml(text) {
+          return text.replace(/&/g, '&amp;').replace(/</g, '&lt;')
+            .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+        }
+        function compactHtml(element) {
+          var tag = element.localName;
+          var parts = ['<', tag];
+          for (var i = 0; i < element.attributes.length; i++) {
+            var attr = element.attributes[i];
+            parts.push(' ', attr.name, '="', escapeHtml(attr.value), '"');
+          }
+          parts.push('>', escapeHtml(element.textContent || ''), '</', tag, '>');
+          return parts.join('');
+        }
+        
         // Event listeners for clicks and inputs
         document.addEventListener('click', function(event) {
           var element = event.target;
-          var arr = JSON.parse(localStorage.clickedElements);
-          arr.push({
-            html: element.outerHTML,
+          recordEvent('click', 'clicks', {
+            html: compactHtml(element),
             url: window.location.href
           });
-          localStorage.clickedElements = JSON.stringify(arr);
         }, true);
         
         document.addEventListener('input', function(event) {
           var element = event.target;
           if (element.tagName.toLowerCase() === 'input' || element.tagName.toLowerCase() === 'textarea') {
-            var arr = JSON.parse(localStorage.inputEvents);
-            arr.push({
+            recordEvent('input', 'inputs', {
               value: element.value,
-              html: element.outerHTML
+              html: compactHtml(element),
+              url: window.location.href
             });
-            localStorage.inputEvents = JSON.stringify(arr);
           }
         }, true);
         
-        // Create the stage control popup
-        var popup = document.createElement('div');
-        popup.id = 'test-recorder-popup';
-        popup.innerHTML = \`
-          <div class="popup-header" id="popup-header">Test Recorder Control</div>
-          <div class="popup-stage">Current: <span id="current-stage">GIVEN</span></div>
-          <div class="popup-buttons">
-            <button data-stage="GIVEN" class="stage-btn active">GIVEN</button>
-            <button data-stage="WHEN" class="stage-btn">WHEN</button>
-            <button data-stage="THEN" class="stage-btn">THEN</button>
-          </div>
-        \`;
-        
-        // Apply styles
-        var style = document.createElement('style');
-        style.textContent = \`
-          #test-recorder-popup {
-            position: fixed;
-            width: 250px;
-            background: rgba(44, 62, 80, 0.95);
-            border-radius: 8px;
-            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3);
-            z-index: 999999;
-            font-family: Arial, sans-serif;
-            color: white;
-            user-select: none;
-          }
-          .popup-header {
-            padding: 12px;
-            background: rgba(52, 73, 94, 0.95);
-            border-radius: 8px 8px 0 0;
-            font-weight: bold;
-            cursor: move;
-            text-align: center;
-            font-size: 14px;
-          }
-          .popup-stage {
-            padding: 10px 12px;
-            text-align: center;
-            font-size: 13px;
-            border-bottom: 1px solid rgba(255, 255, 255, 0.1);
-          }
-          #current-stage {
-            font-weight: bold;
-            color: #3498db;
-          }
-          .popup-buttons {
-            padding: 12px;
-          }
-          .stage-btn {
-            display: block;
-            width: 100%;
-            padding: 10px;
-            margin-bottom: 8px;
-            border: none;
-            border-radius: 4px;
-            background: #7f8c8d;
-            color: white;
-            font-size: 13px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.2s;
-          }
-          .stage-btn:last-child {
-            margin-bottom: 0;
-          }
-          .stage-btn:hover {
-            background: #95a5a6;
-            transform: translateY(-1px);
-          }
-          .stage-btn.active {
-            background: #27ae60;
-            box-shadow: 0 2px 8px rgba(39, 174, 96, 0.4);
-          }
-          .stage-btn.active:hover {
-            background: #2ecc71;
-          }
-        \`;
+        // Build the popup once the body exists (the script may run at document start)
+        function createPopup() {
+          // Create the stage control popup
+          var popup = document.createElement('div');
+          popup.id = 'test-recorder-popup';
+          popup.innerHTML = \`
+            <div class="popup-header" id="popup-header">Test Recorder Control</div>
+            <div class="popup-stage">Current: <span id="current-stage">GIVEN</span></div>
+            <div class="popup-buttons">
+              <button data-stage="GIVEN" class="stage-btn active">GIVEN</button>
+              <button data-stage="WHEN" class="stage-btn">WHEN</button>
+              <button data-stage="THEN" class="stage-btn">THEN</button>
+            </div>
+          \`;
         
-        document.head.appendChild(style);
-        document.body.appendChild(popup);
+          // Apply styles
+          var style = document.createElement('style');
+          style.textContent = \`
+            #test-recorder-popup {
+              position: fixed;
+              width: 250px;
+              background: rgba(44, 62, 80, 0.95);
+              border-radius: 8px;
+              box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3);
+              z-index: 999999;
+              font-family: Arial, sans-serif;
+              color: white;
+              user-select: none;
+            }
+            .popup-header {
+              padding: 12px;
+              background: rgba(52, 73, 94, 0.95);
+              border-radius: 8px 8px 0 0;
+              font-weight: bold;
+              cursor: move;
+              text-align: center;
+              font-size: 14px;
+            }
+            .popup-stage {
+              padding: 10px 12px;
+              text-align: center;
+              font-size: 13px;
+              border-bottom: 1px solid rgba(255, 255, 255, 0.1);
+            }
+            #current-stage {
+              font-weight: bold;
+              color: #3498db;
+            }
+            .popup-buttons {
+              padding: 12px;
+            }
+            .stage-btn {
+              display: block;
+              width: 100%;
+              padding: 10px;
+              margin-bottom: 8px;
+              border: none;
+              border-radius: 4px;
+              background: #7f8c8d;
+              color: white;
+              font-size: 13px;
+              font-weight: bold;
+              cursor: pointer;
+              transition: all 0.2s;
+            }
+            .stage-btn:last-child {
+              margin-bottom: 0;
+            }
+            .stage-btn:hover {
+              background: #95a5a6;
+              transform: translateY(-1px);
+            }
+            .stage-btn.active {
+              background: #27ae60;
+              box-shadow: 0 2px 8px rgba(39, 174, 96, 0.4);
+            }
+            .stage-btn.active:hover {
+              background: #2ecc71;
+            }
+          \`;
         
-        // Restore position from localStorage or use default top-right
-        if (localStorage.popupPosition) {
-          var savedPos = JSON.parse(localStorage.popupPosition);
-          popup.style.left = savedPos.x + 'px';
-          popup.style.top = savedPos.y + 'px';
-          popup.style.right = 'auto';
-        } else {
-          // Default to top-right corner
-          popup.style.right = '20px';
-          popup.style.top = '20px';
-        }
+          document.head.appendChild(style);
+          document.body.appendChild(popup);
         
-        // Restore current stage
-        var currentStage = localStorage.currentStage || 'GIVEN';
-        document.getElementById('current-stage').textContent = currentStage;
-        var buttons = popup.querySelectorAll('.stage-btn');
-        buttons.forEach(function(btn) {
-          if (btn.dataset.stage === currentStage) {
-            btn.classList.add('active');
+          // Restore position from localStorage or use default top-right
+          if (localStorage.popupPosition) {
+            var savedPos = JSON.parse(localStorage.popupPosition);
+            popup.style.left = savedPos.x + 'px';
+            popup.style.top = savedPos.y + 'px';
+            popup.style.right = 'auto';
           } else {
-            btn.classList.remove('active');
+            // Default to top-right corner
+            popup.style.right = '20px';
+            popup.style.top = '20px';
           }
-        });
         
-        // Make popup draggable
-        var isDragging = false;
-        var currentX, currentY, initialX, initialY;
-        var header = document.getElementById('popup-header');
+          // Restore current stage
+          var currentStage = localStorage.currentStage || 'GIVEN';
+          document.getElementById('current-stage').textContent = currentStage;
+          var buttons = popup.querySelectorAll('.stage-btn');
+          buttons.forEach(function(btn) {
+            if (btn.dataset.stage === currentStage) {
+              btn.classList.add('active');
+            } else {
+              btn.classList.remove('active');
+            }
+          });
         
-        header.addEventListener('mousedown', function(e) {
-          isDragging = true;
-          // Convert to left positioning when dragging starts
-          if (popup.style.right && popup.style.right !== 'auto') {
-            popup.style.left = popup.offsetLeft + 'px';
-            popup.style.right = 'auto';
-          }
-          initialX = e.clientX - popup.offsetLeft;
-          initialY = e.clientY - popup.offsetTop;
-        });
+          // Make popup draggable
+          var isDragging = false;
+          var currentX, currentY, initialX, initialY;
+          var header = document.getElementById('popup-header');
         
-        document.addEventListener('mousemove', function(e) {
-          if (isDragging) {
-            e.preventDefault();
-            currentX = e.clientX - initialX;
-            currentY = e.clientY - initialY;
-            popup.style.left = currentX + 'px';
-            popup.style.top = currentY + 'px';
-          }
-        });
+          header.addEventListener('mousedown', function(e) {
+            isDragging = true;
+            // Convert to left positioning when dragging starts
+            if (popup.style.right && popup.style.right !== 'auto') {
+              popup.style.left = popup.offsetLeft + 'px';
+              popup.style.right = 'auto';
+            }
+            initialX = e.clientX - popup.offsetLeft;
+            initialY = e.clientY - popup.offsetTop;
+          });
         
-        document.addEventListener('mouseup', function() {
-          if (isDragging) {
-            isDragging = false;
-            localStorage.popupPosition = JSON.stringify({
-              x: popup.offsetLeft,
-              y: popup.offsetTop
-            });
-          }
-        });
+          document.addEventListener('mousemove', function(e) {
+            if (isDragging) {
+              e.preventDefault();
+              currentX = e.clientX - initialX;
+              currentY = e.clientY - initialY;
+              popup.style.left = currentX + 'px';
+              popup.style.top = currentY + 'px';
+            }
+          });
         
-        // Add click handlers for stage buttons
-        buttons.forEach(function(btn) {
-          btn.addEventListener('click', function(e) {
-            e.stopPropagation();
-            var stage = this.dataset.stage;
-            localStorage.stageChange = stage;
-            localStorage.currentStage = stage;
-            document.getElementById('current-stage').textContent = stage;
-            buttons.forEach(function(b) {
-              b.classList.remove('active');
+          document.addEventListener('mouseup', function() {
+            if (isDragging) {
+              isDragging = false;
+              localStorage.popupPosition = JSON.stringify({
+                x: popup.offsetLeft,
+                y: popup.offsetTop
+              });
+            }
+          });
+        
+          // Add click handlers for stage buttons
+          buttons.forEach(function(btn) {
+            btn.addEventListener('click', function(e) {
+              e.stopPropagation();
+              var stage = this.dataset.stage;
+              if (typeof window.${EVENT_BINDING_NAME} === 'function') {
+                window.${EVENT_BINDING_NAME}(JSON.stringify({ type: 'stage', event: stage }));
+              } else {
+                localStorage.stageChange = stage;
+              }
+              localStorage.currentStage = stage;
+              document.getElementById('current-stage').textContent = stage;
+              buttons.forEach(function(b) {
+                b.classList.remove('active');
+              });
+              this.classList.add('active');
             });
-            this.classList.add('active');
           });
-        });
+        }
+        
+        if (document.readyState === 'loading') {
+          document.addEventListener('DOMContentLoaded', createPopup);
+        } else {
+          createPopup();
+        }
       }
     `;
   }
@@ -637,17 +1081,17 @@ export class TestRecorder {
    */
   private async printRecordedElements(): Promise<void> {
     // Save final stage events from all pages
-    const allEvents: RecordedEvent[] = [];
+    const pages: PageEvents = {};
     for (const url in this.pageEventsMap) {
-      if (this.pageEventsMap[url]?.length > 0) {
-        allEvents.push(...this.pageEventsMap[url]);
+      if (this.pageEventsMap[url]?.types.length > 0) {
+        pages[url] = this.pageEventsMap[url];
       }
     }
 
-    if (allEvents.length > 0) {
+    if (Object.keys(pages).length > 0) {
       this.stageEvents.push({
         stage: this.currentStage,
-        events: allEvents,
+        pages,
       });
     }
 
@@ -678,33 +1122,52 @@ export class TestRecorder {
   private printEventsByStage(): void {
     const stages: RecordingStage[] = ["GIVEN", "WHEN", "THEN"];
 
-    for (const stage of stages) {
-      const stageEventsList = this.stageEvents.filter(
-        (se) => se.stage === stage
-      );
-
-      if (stageEventsList.length === 0) continue;
-
-      console.log(`\n=== ${stage} ===`);
-
-      // Combine all events for this stage
-      const allEvents: RecordedEvent[] = [];
-      for (const se of stageEventsList) {
-        allEvents.push(...se.events);
+    // Group events by stage and URL in a single pass, keeping the last event
+    // for each element. Map.set on an existing key keeps its original
+    // position, so elements stay in first-seen order.
+    // Each element maps to the columns and index of its last event.
+    const eventsByStage = new Map<
+      RecordingStage,
+      Map<string, Map<string, [EventColumns, number]>>
+    >();
+    // Repeated interactions share the same HTML, so scan each one once
+    const elementIds = new Map<string, string>();
+    for (const se of this.stageEvents) {
+      let eventsByUrl = eventsByStage.get(se.stage);
+      if (!eventsByUrl) {
+        eventsByUrl = new Map();
+        eventsByStage.set(se.stage, eventsByUrl);
       }
 
-      // Group events by URL
-      const eventsByUrl = new Map<string, RecordedEvent[]>();
-      for (const event of allEvents) {
-        if (!eventsByUrl.has(event.url)) {
-          eventsByUrl.set(event.url, []);
+      for (const url in se.pages) {
+        let lastEventMap = eventsByUrl.get(url);
+        if (!lastEventMap) {
+          lastEventMap = new Map();
+          eventsByUrl.set(url, lastEventMap);
+        }
+
+        const events = se.pages[url];
+        for (let i = 0; i < events.types.length; i++) {
+          const html = events.htmls[i];
+          let elementId = elementIds.get(html);
+          if (elementId === undefined) {
+            elementId = this.getElementIdentifier(html, events.simplified[i]);
+            elementIds.set(html, elementId);
+          }
+          lastEventMap.set(elementId, [events, i]);
         }
-        eventsByUrl.get(event.url)!.push(event);
       }
+    }
+
+    for (const stage of stages) {
+      const eventsByUrl = eventsByStage.get(stage);
+      if (!eventsByUrl) continue;
+
+      console.log(`\n=== ${stage} ===`);
 
       // Print events grouped by URL
       let isFirstPage = true;
-      for (const [url, events] of eventsByUrl.entries()) {
+      for (const [url, lastEventMap] of eventsByUrl.entries()) {
         const simplifiedUrl = this.simplifyUrl(url);
 
         // Add blank line before each page (except the first)
@@ -715,30 +1178,13 @@ export class TestRecorder {
 
         console.log(`##Page: ${simplifiedUrl}`);
 
-        // Build a map of element identifier to last event for this URL
-        const lastEventMap = new Map<string, RecordedEvent>();
-        const eventOrder: string[] = [];
-
-        for (const event of events) {
-          const elementId = this.getElementIdentifier(event.html);
-
-          // If this element hasn't been seen, track its order
-          if (!lastEventMap.has(elementId)) {
-            eventOrder.push(elementId);
-          }
-
-          // Always update with the latest event for this element
-          lastEventMap.set(elementId, event);
-        }
-
         // Print only the last event for each unique element in order
         let number = 1;
-        for (const elementId of eventOrder) {
-          const event = lastEventMap.get(elementId)!;
-          const html = simplifyHtml(event.html);
+        for (const [events, i] of lastEventMap.values()) {
+          const html = events.simplified[i];
 
-          if (event.type === "input") {
-            const value = event.value || "";
+          if (events.types[i] === "input") {
+            const value = events.values[i] || "";
             // Only print if there's actually a value
             if (value) {
               console.log(
@@ -746,7 +1192,7 @@ export class TestRecorder {
               );
               number++;
             }
-          } else if (event.type === "click") {
+          } else if (events.types[i] === "click") {
             console.log(`${number}. ${html}`);
             number++;
           }
@@ -758,7 +1204,7 @@ export class TestRecorder {
   /**
    * Extract a stable identifier from HTML for element comparison
    */
-  private getElementIdentifier(html: string): string {
+  private getElementIdentifier(html: string, simplified: string): string {
     // Try to extract id, name, or a combination of attributes
     const idMatch = html.match(/id="([^"]+)"/);
     if (idMatch) return `id:${idMatch[1]}`;
@@ -773,13 +1219,15 @@ export class TestRecorder {
     }
 
     // Fallback to simplified HTML
-    return simplifyHtml(html);
+    return simplified;
   }
 
   /**
    * Clean up resources
    */
   private async cleanUp(): Promise<void> {
+    this.closeEventLog();
+
     try {
       if (this.driver) {
         await this.driver.quit();
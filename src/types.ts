@@ -19,22 +19,74 @@ export interface ClickedElement {
 export interface InputEvent {
   value: string;
   html: string;
+  url: string;
 }
 
 /**
- * Represents a recorded event (click or input)
+ * Event pushed from the page through the CDP runtime binding: a click, an
+ * input, or a stage selected in the popup
  */
-export interface RecordedEvent {
-  type: 'click' | 'input';
-  html: string;
-  value?: string;
+export type BoundEvent =
+  | { type: 'click'; event: ClickedElement }
+  | { type: 'input'; event: InputEvent }
+  | { type: 'stage'; event: RecordingStage };
+
+/**
+ * Minimal view of the CDP connection returned by createCDPConnection
+ */
+export interface CdpConnection {
+  execute(method: string, params: object, callback: null): void;
+  _wsConnection: {
+    on(event: 'message', listener: (data: Buffer) => void): void;
+  };
+}
+
+/**
+ * Result of the CDP Runtime.compileScript command
+ */
+export interface CdpCompileScriptResult {
+  scriptId?: string;
+  exceptionDetails?: object;
+}
+
+/**
+ * Result of the CDP Runtime.runScript command with returnByValue
+ */
+export interface CdpRunScriptResult<T> {
+  result: { value?: T };
+  exceptionDetails?: object;
+}
+
+/**
+ * Interactions read from the page in a single polling round-trip
+ */
+export interface InteractionBatch {
+  clicks: ClickedElement[];
+  inputs: InputEvent[];
+  stageChange: RecordingStage | null;
   url: string;
 }
 
 /**
- * Generic type for page-based mapping of elements/events
+ * Recorded events (clicks and inputs) for one page, stored as parallel
+ * columns: the event at index i is made of types[i], htmls[i], etc.
+ */
+export interface EventColumns {
+  types: Array<'click' | 'input'>;
+  htmls: string[];
+  simplified: string[];
+  values: Array<string | undefined>;
+}
+
+/**
+ * Page-based mapping of recorded events
+ */
+export type PageEvents = Record<string, EventColumns>;
+
+/**
+ * Page-based set of unique keys for O(1) dedup, in insertion order
  */
-export type PageMap<T> = Record<string, T[]>;
+export type PageSet = Record<string, Set<string>>;
 
 /**
  * Recording stage for BDD-style test organization
@@ -46,5 +98,5 @@ export type RecordingStage = 'GIVEN' | 'WHEN' | 'THEN';
  */
 export interface StageEvents {
   stage: RecordingStage;
-  events: RecordedEvent[];
+  pages: PageEvents;
 }
\ No newline at end of file